@@ -17,9 +17,10 @@ Configuration:
 - (Optional) Ensure the script is set up as a systemd service for persistent and managed running.
 
 To use:
-1. Install the required Python library `paho-mqtt` using pip.  (pip3 install paho-mqtt)
+1. Install the required Python library `paho-mqtt` (2.0 or newer) using pip.  (pip3 install paho-mqtt)
 2. Update the script below with your specific MQTT broker details and credentials.
 3. (Optional) Update the path and enable the provided systemd service file to run the script as a service, auto-restarting on failure and reboot.
+4. (Optional) Install `systemd-python` (pip3 install systemd-python) to log straight to the systemd journal instead of through stdout.
 
 Example: 
 In the default setup below, incoming message from LOCAL_TOPIC msh/US/2/e/LongFast/ are republished on the remote server with REMOTE_TOPIC egr/home/2/e/LongFast/
@@ -27,12 +28,27 @@ In the default setup below, incoming message from LOCAL_TOPIC msh/US/2/e/LongFas
 """
 
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import logging
+import os
+import random
+import signal
+import socket
 import sys
-import time
+import threading
 
-# Configure logging
-logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
+try:
+    from systemd.journal import JournalHandler
+except ImportError:
+    JournalHandler = None
+
+# Configure logging; when running under systemd with systemd-python installed, records are sent
+# to the journal directly instead of being formatted and written through the stdout pipe
+if JournalHandler is not None and "JOURNAL_STREAM" in os.environ:
+    logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[JournalHandler(SYSLOG_IDENTIFIER="mqtt-bridge")])
+else:
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger()
 
 
@@ -41,9 +57,11 @@ logger = logging.getLogger()
 # Local broker details
 LOCAL_BROKER = "local-mqtt-ip-or-hostname-here"
 LOCAL_PORT = 1883
-LOCAL_TOPIC = "msh/US/2/e/LongFast/#" #do not remove the # at the end of the local topic
+LOCAL_TOPIC = "msh/US/2/e/LongFast/#" #do not remove the # at the end of the local topic, and do not use + wildcards
 LOCAL_USERNAME = "local-username-goes-here"
 LOCAL_PASSWORD = "local-password-goes-here"
+LOCAL_CLIENT_ID = "" #leave empty to use meshtastic-forwarder-<hostname>-<local topic>; must be unique for each copy of this script
+LOCAL_QOS = 0 #set to 1 to have the local broker queue messages while the local connection is reconnecting (messages arriving while the remote broker is down are still lost)
 
 # Remote broker details
 REMOTE_BROKER = "remote-mqtt-ip-or-hostname-here"
@@ -51,121 +69,160 @@ REMOTE_PORT = 1883
 REMOTE_TOPIC_PREFIX = "egr/home/2/e/LongFast/"
 REMOTE_USERNAME = "remote-username-goes-here"
 REMOTE_PASSWORD = "remote-password-goes-here"
+REMOTE_LOW_LATENCY = True #set to False to let the kernel merge small publishes into fewer TCP segments (adds latency; still one send per message)
 #-----------------------------------------------#
 #####          STOP EDITING HERE            #####
 
-# Failure tracking and reconnection cooldown
-failure_count = 0
-failure_threshold = 5
-reconnect_delay = 5  # Initial delay for reconnections (in seconds)
-last_reconnect_attempt = time.time()  # Track last reconnect attempt time
+# Topics are rewritten by swapping a fixed prefix, so LOCAL_TOPIC must be a plain prefix followed by /#
+if not LOCAL_TOPIC.endswith("/#") or "+" in LOCAL_TOPIC or "#" in LOCAL_TOPIC[:-1]:
+    logger.critical(f"LOCAL_TOPIC must end in /# and contain no other wildcards, got {LOCAL_TOPIC!r}")
+    sys.exit(1)
 
-# Callback when a message is received from the local broker
-def on_local_message(client, userdata, message):
-    global failure_count
-    local_topic_suffix = message.topic[len("msh/US/2/e/LongFast/"):]
-    remote_topic = REMOTE_TOPIC_PREFIX + local_topic_suffix
+# Topic prefixes used to rewrite forwarded topics
+_LOCAL_PREFIX = LOCAL_TOPIC[:-1]
+_LOCAL_PREFIX_LEN = len(_LOCAL_PREFIX)
+_REMOTE_PREFIX = REMOTE_TOPIC_PREFIX
 
-    try:
-        result = remote_client.publish(remote_topic, message.payload)
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"Message sent to topic {remote_topic}")
-            failure_count = 0
-        else:
-            raise Exception("Publish failed")
-    except Exception as e:
-        failure_count += 1
-        logger.error(f"Failed to send message to topic {remote_topic}: {e}")
-        if failure_count >= failure_threshold:
-            logger.critical(f"Exceeded failure threshold. Attempting to reconnect...")
-            reconnect_brokers()
+# Remote topic for each local topic seen so far (None for topics that are skipped).
+# Meshtastic topics end in the gateway node ID, so there are few distinct ones; the cache is cleared if it ever grows past the limit.
+remote_topic_cache = {}
+remote_topic_cache_limit = 1024
+
+# Session on the local broker that survives reconnects (and keeps QoS 1 messages meanwhile).
+# Each process starts clean, so a changed LOCAL_TOPIC never inherits the old subscription.
+local_client_id = LOCAL_CLIENT_ID or f"meshtastic-forwarder-{socket.gethostname()}-{_LOCAL_PREFIX.strip('/').replace('/', '-')}"
+local_session_expiry = 3600  # How long the local broker keeps the session while disconnected (in seconds)
+
+# Reconnection backoff, handled by Paho's network loop: starts at 1 second and doubles up to 60.
+# The whole schedule is scaled by a per-process jitter factor so bridges restarted together don't retry in lockstep.
+reconnect_jitter = random.uniform(0.9, 1.0)
+reconnect_min_delay = 1 * reconnect_jitter
+reconnect_max_delay = 60 * reconnect_jitter
+
+# Forwarding statistics, logged periodically instead of once per message
+forwarded_count = 0
+stats_interval = 60  # How often to log the forwarded message count (in seconds)
 
 # Callback for successful connection
-def on_connect(client, userdata, flags, rc, properties=None):
-    if rc == 0:
-        logger.info(f"Connected successfully to {client._host}")
-        client.subscribe(LOCAL_TOPIC)
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code == 0:
+        logger.info(f"Connected successfully to {userdata['host']}")
+        if userdata["subscribe"]:
+            client.subscribe(LOCAL_TOPIC, qos=LOCAL_QOS)
     else:
-        logger.error(f"Connection failed with code {rc}")
-
-# Callback when disconnected
-def on_disconnect(client, userdata, rc, properties=None):
-    global last_reconnect_attempt
-    if rc != 0:
-        logger.warning(f"Unexpected disconnection from {client._host}")
-        
-        # Cooldown before attempting reconnection to avoid immediate retries
-        if time.time() - last_reconnect_attempt > reconnect_delay:
-            last_reconnect_attempt = time.time()
-            reconnect_brokers()
-
-# Reconnect logic with cooldown and backoff
-def reconnect_brokers():
-    global failure_count, reconnect_delay, last_reconnect_attempt
-    if not local_client.is_connected() or not remote_client.is_connected():
-        try:
-            logger.info("Reconnecting to local broker...")
-            local_client.reconnect()
-            logger.info("Reconnecting to remote broker...")
-            remote_client.reconnect()
-            
-            # Reset delay and failure count after a successful reconnect
-            reconnect_delay = 5
-            failure_count = 0
-            last_reconnect_attempt = time.time()
-            logger.info("Reconnected successfully to both brokers.")
-            
-            # Stabilization delay after reconnection
-            time.sleep(2)  # Adjust this delay if needed
-        except Exception as e:
-            # Apply exponential backoff to prevent rapid reconnect attempts
-            reconnect_delay = min(reconnect_delay * 2, 60)
-            logger.error(f"Reconnection failed: {e}. Retrying in {reconnect_delay} seconds.")
+        logger.error(f"Connection failed with code {reason_code}")
+
+# Callback when a connection attempt fails before reaching the broker
+def on_connect_fail(client, userdata):
+    logger.error(f"Failed to connect to {userdata['host']}, retrying...")
+
+# Callback when disconnected; Paho's network loop reconnects on its own
+def on_disconnect(client, userdata, disconnect_flags, reason_code, properties):
+    if reason_code != 0:
+        logger.warning(f"Unexpected disconnection from {userdata['host']}")
+
+# Callback when a broker socket is opened
+def on_socket_open(client, userdata, sock):
+    # Disable Nagle so small messages are sent immediately instead of being held back.
+    # With low latency off, Nagle stays on and the kernel merges back-to-back publishes into fewer TCP segments
+    # (Paho still makes one send() per message).
+    if userdata["low_latency"]:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Let the kernel probe idle connections so a silently dropped peer is noticed in ~60s
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):  # Linux-only options
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    # SO_SNDBUF is deliberately left alone: setting it turns off TCP buffer autotuning, which on Linux already
+    # grows the send buffer for bursts up to the net.ipv4.tcp_wmem maximum. Raise that sysctl if bursts still stall.
 
 # Create clients for local and remote brokers
-local_client = mqtt.Client(client_id="", protocol=mqtt.MQTTv5, transport="tcp")
+local_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=local_client_id, protocol=mqtt.MQTTv5, transport="tcp")
 local_client.username_pw_set(LOCAL_USERNAME, LOCAL_PASSWORD)
-local_client.on_message = on_local_message
+local_client.user_data_set({"host": LOCAL_BROKER, "subscribe": True, "low_latency": True})
+local_client.reconnect_delay_set(min_delay=reconnect_min_delay, max_delay=reconnect_max_delay)
 local_client.on_connect = on_connect
+local_client.on_connect_fail = on_connect_fail
 local_client.on_disconnect = on_disconnect
+local_client.on_socket_open = on_socket_open
 
-remote_client = mqtt.Client(client_id="", protocol=mqtt.MQTTv5, transport="tcp")
+remote_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="", protocol=mqtt.MQTTv5, transport="tcp")
 remote_client.username_pw_set(REMOTE_USERNAME, REMOTE_PASSWORD)
+remote_client.user_data_set({"host": REMOTE_BROKER, "subscribe": False, "low_latency": REMOTE_LOW_LATENCY})
+remote_client.reconnect_delay_set(min_delay=reconnect_min_delay, max_delay=reconnect_max_delay)
+remote_client.max_inflight_messages_set(1000)  # Don't let the inflight window throttle publishes
+remote_client.max_queued_messages_set(0)  # 0 = unlimited outgoing queue
 remote_client.on_connect = on_connect
+remote_client.on_connect_fail = on_connect_fail
 remote_client.on_disconnect = on_disconnect
-
-# Connect to brokers
-def connect_local():
+remote_client.on_socket_open = on_socket_open
+
+# Callback when a message is received from the local broker.
+# Defined after remote_client so hot-path lookups can be bound as default arguments (fast locals).
+def on_local_message(client, userdata, message, _publish=remote_client.publish, _ok=mqtt.MQTT_ERR_SUCCESS,
+                     _log=logger, _debug=logging.DEBUG, _prefix_len=_LOCAL_PREFIX_LEN, _remote_prefix=_REMOTE_PREFIX,
+                     _local_prefix=_LOCAL_PREFIX, _topic_cache=remote_topic_cache):
+    global forwarded_count
+    local_topic = message.topic
     try:
-        local_client.connect(LOCAL_BROKER, LOCAL_PORT, 60)
-    except Exception as e:
-        logger.error(f"Failed to connect to local broker: {e}")
+        remote_topic = _topic_cache[local_topic]
+    except KeyError:
+        local_topic_suffix = local_topic[_prefix_len:]
+
+        # Skip topics outside LOCAL_TOPIC, bare-prefix topics and anything already carrying the remote prefix,
+        # so a bridge from the remote broker back to the local one can't loop messages forever
+        if (not local_topic.startswith(_local_prefix) or not local_topic_suffix
+                or local_topic.startswith(_remote_prefix) or local_topic_suffix.startswith(_remote_prefix)):
+            remote_topic = None
+        else:
+            remote_topic = _remote_prefix + local_topic_suffix
+
+        if len(_topic_cache) >= remote_topic_cache_limit:
+            _topic_cache.clear()
+        _topic_cache[local_topic] = remote_topic
+
+    if remote_topic is None:
+        return
 
-def connect_remote():
     try:
-        remote_client.connect(REMOTE_BROKER, REMOTE_PORT, 60)
+        # message.payload is already bytes and is handed to Paho as-is (Paho rejects memoryview payloads)
+        result = _publish(remote_topic, message.payload, qos=0)
+        if result.rc == _ok:
+            if _log.isEnabledFor(_debug):
+                _log.debug("Message sent to topic %s", remote_topic)
+            forwarded_count += 1
+        else:
+            raise Exception("Publish failed")
     except Exception as e:
-        logger.error(f"Failed to connect to remote broker: {e}")
+        _log.error(f"Failed to send message to topic {remote_topic}: {e}")
 
-connect_local()
-connect_remote()
+local_client.on_message = on_local_message
+
+# Connect to brokers; the network loops retry the first connection and any later drops
+local_connect_properties = Properties(PacketTypes.CONNECT)
+local_connect_properties.SessionExpiryInterval = local_session_expiry
+local_client.connect_async(LOCAL_BROKER, LOCAL_PORT, 60, properties=local_connect_properties)
+remote_client.connect_async(REMOTE_BROKER, REMOTE_PORT, 60)
 
 # Start the loop to process messages
-local_client.loop_start()
 remote_client.loop_start()
+local_client.loop_start()
 
-# Periodic connection health check
-try:
-    while True:
-        if not local_client.is_connected() or not remote_client.is_connected():
-            logger.warning("Detected disconnection, attempting to reconnect...")
-            reconnect_brokers()
-        time.sleep(1)  # Adjust as needed to reduce CPU usage
-except KeyboardInterrupt:
-    pass
-
-# Stop loop and disconnect
+# Block until asked to stop, logging a forwarding summary every stats_interval
+stop_event = threading.Event()
+signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+last_forwarded_count = 0
+while not stop_event.wait(stats_interval):
+    current_count = forwarded_count
+    logger.info(f"{current_count - last_forwarded_count} messages forwarded in the last {stats_interval} seconds")
+    last_forwarded_count = current_count
+
+# Stop loop and disconnect; the local session is ended too, since the next process starts a clean one
 local_client.loop_stop()
 remote_client.loop_stop()
-local_client.disconnect()
+local_disconnect_properties = Properties(PacketTypes.DISCONNECT)
+local_disconnect_properties.SessionExpiryInterval = 0
+local_client.disconnect(properties=local_disconnect_properties)
 remote_client.disconnect()